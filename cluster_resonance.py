@@ -1,6 +1,7 @@
 # cluster_resonance.py
 
 import os, json
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
 import umap, hdbscan
@@ -35,3 +36,26 @@ def cluster_and_select(df: pd.DataFrame, n_neighbors: int = 15):
         idx = len(members)//2
         seeds.append(members.iloc[idx]["path"])
     return df, seeds
+
+def assign_clusters(df_clust: pd.DataFrame, df_new: pd.DataFrame) -> np.ndarray:
+    """
+    Метки для новых фрагментов без перекластеризации: ближайший центроид
+    среди кластеров, в радиус которых (максимум расстояний членов до
+    центроида) попадает фрагмент, в тех же нормированных признаках.
+    Вне всех радиусов или без кластеров — шум, -1.
+    """
+    known = df_clust[df_clust["cluster_label"] >= 0]
+    if known.empty or df_new.empty:
+        return np.full(len(df_new), -1, dtype=np.int64)
+    scaler = StandardScaler().fit(df_clust[["size","strings"]].values)
+    X      = scaler.transform(known[["size","strings"]].values)
+    labels = np.sort(known["cluster_label"].unique())
+    member = known["cluster_label"].values[:, None] == labels[None, :]
+    cents  = np.stack([X[member[:, j]].mean(axis=0) for j in range(len(labels))])
+    radius = np.array([((X[member[:, j]] - cents[j]) ** 2).sum(axis=1).max()
+                       for j in range(len(labels))])
+    Y      = scaler.transform(df_new[["size","strings"]].values)
+    dist   = ((Y[:, None, :] - cents[None, :, :]) ** 2).sum(axis=2)
+    dist   = np.where(dist <= radius[None, :] + 1e-9, dist, np.inf)
+    near   = dist.argmin(axis=1)
+    return np.where(np.isfinite(dist.min(axis=1)), labels[near], -1)
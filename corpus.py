@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+corpus.py
+
+Режим корпуса: много raw-полей за один запуск.
+Каждое поле обрабатывается в общем пуле процессов в свой шард
+(<output_dir>/fields/<field>/: extracted/, metrics.pkl, batch.json, graph.pkl),
+фрагменты и seed-ы получают префикс поля. merge_shards сводит шарды
+в общие metrics.pkl, batch.json, clusters.csv, граф и статистику.
+"""
+
+import sys, json, pickle, argparse
+import multiprocessing as mp
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import networkx as nx
+
+FIELD_SUFFIXES = (".raw", ".bin")
+SHARDS_DIR     = "fields"
+
+
+def discover_fields(source) -> list:
+    """
+    Каталог — все *.raw/*.bin в нём (без рекурсии);
+    манифест — .json со списком путей или текст по пути на строку.
+    Относительные пути манифеста считаются от его каталога.
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(p for p in source.iterdir()
+                      if p.is_file() and p.suffix.lower() in FIELD_SUFFIXES)
+    if source.suffix.lower() == ".json":
+        entries = json.loads(source.read_text(encoding="utf-8"))
+    else:
+        entries = [l.strip() for l in source.read_text(encoding="utf-8").splitlines()]
+        entries = [l for l in entries if l and not l.startswith("#")]
+    return [p if p.is_absolute() else source.parent / p for p in map(Path, entries)]
+
+
+def field_namespaces(fields: list) -> dict:
+    """
+    Уникальное имя поля: stem, при совпадении — stem_2, stem_3…
+    Собственные stem-ы занимаются первыми, суффикс подбирается, пока имя
+    не свободно: a.raw, sub/a.raw, a_2.raw → a, a_3, a_2.
+    """
+    stems = {f: f.stem.replace(":", "_") for f in fields}
+    taken, out = set(), {}
+    for f, ns in stems.items():
+        if ns not in taken:
+            out[f] = ns
+            taken.add(ns)
+    for f, ns in stems.items():
+        if f in out:
+            continue
+        k = 2
+        while f"{ns}_{k}" in taken:
+            k += 1
+        out[f] = f"{ns}_{k}"
+        taken.add(out[f])
+    return {f: out[f] for f in stems}
+
+
+def process_field(raw_path: str, namespace: str, shard_dir: str, cfg: dict) -> str:
+    """Воркер: extract → metrics → batch → граф одного поля в shard_dir."""
+    from resonant_extract import extract_fragments
+    from metrics_collector import collect_metrics
+    from batch_analysis import batch_analyze, save_results
+    from graph_export import build_graph
+    from seed_index import build_seed_index
+
+    shard     = Path(shard_dir)
+    frags_dir = shard / "extracted"
+    shard.mkdir(parents=True, exist_ok=True)
+
+    extract_fragments(raw_path, export_json=False,
+                      extract_dir=frags_dir, namespace=namespace)
+    meta_db = frags_dir / "metadata.db"
+
+    df = collect_metrics(str(frags_dir), str(meta_db))
+    df.insert(0, "field", pd.Categorical([namespace] * len(df)))
+    df.to_pickle(shard / "metrics.pkl")
+
+    batch = batch_analyze(str(frags_dir), jobs=int(cfg.get("corpus_batch_jobs", 2)))
+    save_results(batch, str(shard / "batch.json"))
+
+    seed_idx = (build_seed_index(raw_path, shards=int(cfg.get("seed_index_shards", 0)))
+                if cfg.get("seed_index") else None)
+    G = build_graph(
+        meta_db,
+        shard / "batch.json",
+        frags_dir,
+        cfg["node_attrs"],
+        cfg["edge_attrs"],
+        cfg["color_by"],
+        False,                      # связи кластеров — в merge_shards, по общим кластерам
+        cfg["fallback_random_seeds_count"],
+        cfg["add_cycle"],
+        cfg["echo_enabled"],
+        None,
+        seed_index=seed_idx
+    )
+    for n in G.nodes:
+        G.nodes[n].setdefault("field", namespace)
+    with open(shard / "graph.pkl", "wb") as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return str(shard)
+
+
+def merge_shards(shard_dirs: list, out_dir: Path, cfg: dict, logger) -> dict:
+    """Сводит шарды в общие выходы; возвращает статистику графа."""
+    from cluster_resonance import load_batch_results, cluster_and_select
+    from graph_export import visualize_graph, export_graphml
+    from graph_analysis import analyze_graph
+    from metrics_collector import aggregate_metrics, plot_aggregates, concat_metrics
+
+    shard_dirs = [Path(s) for s in shard_dirs]
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # метрики
+    df = concat_metrics([pd.read_pickle(s / "metrics.pkl")
+                        for s in shard_dirs if (s / "metrics.pkl").exists()])
+    df.to_pickle(out_dir / "metrics.pkl")
+    logger.info("Корпус: метрик %d из %d полей", len(df), len(shard_dirs))
+    if not df.empty:
+        cols = [c if c in df.columns else None
+                for c in (cfg["x_col"], cfg["y_col"], cfg["hue_col"])]
+        if cols[0] and cols[1]:
+            plot_aggregates(aggregate_metrics(df, *cols),
+                            str(out_dir / cfg["plot_dir"]))
+
+    # входы кластеризации
+    batch = []
+    for s in shard_dirs:
+        if (s / "batch.json").exists():
+            batch.extend(json.loads((s / "batch.json").read_text(encoding="utf-8")))
+    batch_path = out_dir / cfg["batch_results"]
+    batch_path.write_text(json.dumps(batch, indent=2), encoding="utf-8")
+
+    df_clust, seeds = None, []
+    if batch:
+        df_clust, seeds = cluster_and_select(load_batch_results(str(batch_path)))
+        df_clust.to_csv(out_dir / cfg["cluster_csv"], index=False)
+        logger.info("Корпус: кластеры сохранены, seeds: %d", len(seeds))
+
+    # графы: корни __primary_root__/__secondary_root__ общие для всех полей
+    graphs = []
+    for s in shard_dirs:
+        if (s / "graph.pkl").exists():
+            with open(s / "graph.pkl", "rb") as f:
+                graphs.append(pickle.load(f))
+    G = nx.compose_all(graphs) if graphs else nx.DiGraph()
+    G.graph["cluster_seeds"] = seeds
+    G.graph["fields"] = [s.name for s in shard_dirs]
+    if G.number_of_nodes() == 0:
+        logger.warning("Корпус: граф пуст")
+        return {}
+
+    # connect_clusters: представитель кластера → остальные его фрагменты
+    if cfg.get("connect_clusters") and df_clust is not None:
+        links = 0
+        names = df_clust["path"].map(lambda p: Path(p).name)
+        for s in seeds:
+            label   = df_clust.loc[df_clust["path"] == s, "cluster_label"].iloc[0]
+            src     = Path(s).name
+            members = names[(df_clust["cluster_label"] == label) & (names != src)]
+            for dst in members:
+                if src in G and dst in G:
+                    G.add_edge(src, dst, cluster_link=True)
+                    links += 1
+        logger.info("Корпус: связей кластеров %d", links)
+
+    if cfg.get("corpus_graph_image", True):
+        visualize_graph(G, str(out_dir / cfg["graph_image"]), cfg["color_by"])
+    export_graphml(G, str(out_dir / cfg["graphml"]))
+    return analyze_graph(G, out_dir)
+
+
+def run_corpus(source, cfg: dict, logger, jobs: int = None,
+               shards_only: bool = False) -> dict:
+    """
+    Обрабатывает все поля source в одном пуле процессов.
+    shards_only — только шарды, merge запускается отдельно (merge_shards).
+    """
+    out_dir   = Path(cfg["output_dir"])
+    shard_dir = out_dir / SHARDS_DIR
+    fields    = discover_fields(source)
+    missing   = [f for f in fields if not f.exists()]
+    for f in missing:
+        logger.warning("Поле '%s' не найдено — пропускаем", f)
+    names = field_namespaces([f for f in fields if f.exists()])
+    if not names:
+        logger.error("Корпус '%s': нет raw-полей", source)
+        return {}
+
+    jobs = jobs or int(cfg["jobs"])
+    logger.info("Корпус: %d полей, воркеров: %d", len(names), jobs)
+    shards = []
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp.get_context("spawn")) as ex:
+        futs = {
+            ex.submit(process_field, str(f), ns, str(shard_dir / ns), cfg): ns
+            for f, ns in names.items()
+        }
+        for fut in as_completed(futs):
+            try:
+                shards.append(fut.result())
+                logger.info("Поле готово: %s", futs[fut])
+            except Exception as e:
+                logger.error("Поле %s: ошибка %s", futs[fut], e)
+
+    if shards_only:
+        logger.info("Шарды сохранены в %s", shard_dir)
+        return {}
+    return merge_shards(sorted(shards), out_dir, cfg, logger)
+
+
+if __name__ == "__main__":
+    from pipeline import setup_logging, load_config
+
+    logger = setup_logging()
+    p = argparse.ArgumentParser(__doc__)
+    p.add_argument("shards", nargs="*", help="Shard dirs to merge (default: all in output_dir/fields)")
+    p.add_argument("--config", "-c", default="config.yaml")
+    args = p.parse_args()
+
+    cfg       = load_config(args.config, logger)
+    shard_dir = Path(cfg["output_dir"]) / SHARDS_DIR
+    shards    = args.shards or sorted(
+        str(d) for d in (shard_dir.iterdir() if shard_dir.exists() else []) if d.is_dir()
+    )
+    if not shards:
+        sys.exit("[ERROR] No shards to merge")
+    stats = merge_shards(shards, Path(cfg["output_dir"]), cfg, logger)
+    logger.info("Corpus graph: %s", {k: stats.get(k) for k in ("num_nodes", "num_edges")})
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+field_profile.py
+
+Профиль всего field.raw скользящим окном: энтропия Шеннона и доли
+классов байтов (нули, печатные ASCII, старшие >= 0x80) в каждом окне.
+
+Окна не пересчитываются с нуля: поле режется на блоки gcd(window, stride),
+по блокам строятся гистограммы, а гистограмма окна — разность
+кумулятивных сумм. При мелком gcd одна гистограмма сдвигается по полю
+(+stride новых байт, -stride старых). Энтропия считается по таблице
+c*log2(c) целых счётчиков. Файл читается через memmap пачками окон.
+"""
+
+import sys, json, argparse
+from math import gcd, log2
+from pathlib import Path
+
+import numpy as np
+
+from resonant_extract import WAVES, FRAG_SIZE, PULSES_PER_WAVE, SEED_SIZE
+
+WINDOW       = 256
+STRIDE       = 64
+WAVE_SPAN    = (PULSES_PER_WAVE - 1) * (SEED_SIZE // 2) + FRAG_SIZE   # байт под одну волну
+BLOCK_CELLS  = 1 << 20                  # ячеек гистограмм (int32) и байт на пачку — 4 MiB
+MIN_BLOCK    = 16                       # при меньшем gcd — скользящая гистограмма
+
+PROFILE_DTYPE = np.dtype([
+    ("offset",    np.uint64),
+    ("entropy",   np.float32),
+    ("zero",      np.float32),
+    ("printable", np.float32),
+    ("high",      np.float32),
+])
+
+_PRINTABLE = np.zeros(256, dtype=bool); _PRINTABLE[0x20:0x7F] = True
+_HIGH      = np.zeros(256, dtype=bool); _HIGH[0x80:] = True
+
+
+def _clogc(window: int) -> np.ndarray:
+    # c*log2(c) для целых счётчиков 0..window; энтропия окна без матриц p
+    c = np.arange(window + 1, dtype=np.float64)
+    c[0] = 1.0
+    t = c * np.log2(c)
+    t[0] = 0.0
+    return t
+
+
+def _window_stats(hist: np.ndarray, clogc: np.ndarray, window: int):
+    ent = log2(window) - clogc[hist].sum(axis=1) / window
+    return (
+        ent,
+        hist[:, 0] / window,
+        hist[:, _PRINTABLE].sum(axis=1) / window,
+        hist[:, _HIGH].sum(axis=1) / window,
+    )
+
+
+def _profile_blocks(buf: np.ndarray, prof: np.ndarray, window: int, stride: int, g: int):
+    # гистограммы блоков длины g и их кумулятивные суммы (int32);
+    # пачка — не больше BLOCK_CELLS ячеек гистограмм и байт
+    w_blocks = window // g
+    s_blocks = stride // g
+    max_blocks = max(w_blocks, BLOCK_CELLS // max(256, g))
+    per_batch  = max(1, (max_blocks - w_blocks) // s_blocks + 1)
+    clogc = _clogc(window)
+
+    for first in range(0, len(prof), per_batch):
+        last    = min(first + per_batch, len(prof))
+        start   = first * stride
+        nblocks = (last - 1 - first) * s_blocks + w_blocks
+        region  = buf[start: start + nblocks * g].reshape(nblocks, g)
+
+        bid  = np.arange(nblocks, dtype=np.int64)[:, None] * 256
+        hist = np.bincount((bid + region).ravel(), minlength=nblocks * 256)
+        cum  = np.zeros((nblocks + 1, 256), dtype=np.int32)
+        np.cumsum(hist.reshape(nblocks, 256), axis=0, dtype=np.int32, out=cum[1:])
+        del hist
+
+        lo = np.arange(last - first) * s_blocks
+        _fill(prof[first:last], _window_stats(cum[lo + w_blocks] - cum[lo], clogc, window))
+
+
+def _profile_sliding(buf: np.ndarray, prof: np.ndarray, window: int, stride: int):
+    # мелкий gcd: одна гистограмма, на каждом шаге +stride байт / -stride байт
+    per_batch = max(1, (BLOCK_CELLS - window) // stride + 1)
+    clogc = _clogc(window)
+    emax  = log2(window)
+    hist  = np.zeros(256, dtype=np.int64)
+
+    for first in range(0, len(prof), per_batch):
+        last = min(first + per_batch, len(prof))
+        ent  = np.empty(last - first)
+        for i in range(first, last):
+            a = i * stride
+            if i == 0 or stride >= window:
+                hist = np.bincount(buf[a: a + window], minlength=256)
+            else:
+                hist += np.bincount(buf[a + window - stride: a + window], minlength=256)
+                hist -= np.bincount(buf[a - stride: a], minlength=256)
+            ent[i - first] = emax - clogc[hist].sum() / window
+
+        # доли классов байтов — разность кумулятивных сумм по пачке
+        start  = first * stride
+        region = buf[start: (last - 1) * stride + window]
+        lo     = np.arange(last - first) * stride
+        fracs  = []
+        for mask in (region == 0, _PRINTABLE[region], _HIGH[region]):
+            cum = np.zeros(len(region) + 1, dtype=np.int32)
+            np.cumsum(mask, dtype=np.int32, out=cum[1:])
+            fracs.append((cum[lo + window] - cum[lo]) / window)
+        _fill(prof[first:last], (ent, *fracs))
+
+
+def _fill(out: np.ndarray, stats):
+    ent, zero, printable, high = stats
+    out["entropy"]   = ent
+    out["zero"]      = zero
+    out["printable"] = printable
+    out["high"]      = high
+
+
+def profile_field(raw_file: str, window: int = WINDOW, stride: int = STRIDE) -> np.ndarray:
+    """Структурированный массив PROFILE_DTYPE, по строке на окно."""
+    if window <= 0 or stride <= 0:
+        raise ValueError(f"window/stride must be positive: {window}/{stride}")
+    mm = np.memmap(raw_file, dtype=np.uint8, mode="r")
+    if len(mm) < window:
+        return np.empty(0, dtype=PROFILE_DTYPE)
+
+    buf   = np.asarray(mm)
+    n_win = (len(buf) - window) // stride + 1
+    prof  = np.empty(n_win, dtype=PROFILE_DTYPE)
+    prof["offset"] = np.arange(n_win, dtype=np.uint64) * np.uint64(stride)
+
+    g = gcd(window, stride)
+    if g >= MIN_BLOCK:
+        _profile_blocks(buf, prof, window, stride, g)
+    else:
+        _profile_sliding(buf, prof, window, stride)
+    return prof
+
+
+def detect_segments(prof: np.ndarray, window: int = WINDOW,
+                    high: float = None, low: float = None) -> list:
+    """
+    Непрерывные участки окон с энтропией >= high или <= low.
+    По умолчанию пороги — доли максимума log2(min(window, 256)).
+    """
+    if len(prof) == 0:
+        return []
+    emax = log2(min(window, 256))
+    high = 0.85 * emax if high is None else high
+    low  = 0.5 * emax if low  is None else low
+
+    ent  = prof["entropy"]
+    segs = []
+    for kind, mask in (("high", ent >= high), ("low", ent <= low)):
+        edges  = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        stops  = np.flatnonzero(edges == -1)
+        for s, e in zip(starts, stops):
+            segs.append({
+                "kind":         kind,
+                "start":        int(prof["offset"][s]),
+                "end":          int(prof["offset"][e - 1]) + window,
+                "mean_entropy": round(float(ent[s:e].mean()), 4),
+            })
+    return sorted(segs, key=lambda d: d["start"])
+
+
+def adaptive_wave_offsets(segments: list, kind: str = "high", waves: int = WAVES) -> list:
+    """
+    Стартовые смещения волн внутри сегментов нужного типа: от самых
+    длинных к коротким, с шагом WAVE_SPAN, пока не наберётся waves.
+    Волна целиком (все импульсы) помещается в сегмент.
+    """
+    offsets = []
+    for s in sorted(
+        (s for s in segments if s["kind"] == kind),
+        key=lambda s: (-(s["end"] - s["start"]), s["start"])
+    ):
+        off = s["start"]
+        while off + WAVE_SPAN <= s["end"] and len(offsets) < waves:
+            offsets.append(off)
+            off += WAVE_SPAN
+    return sorted(offsets)
+
+
+def save_profile(prof: np.ndarray, segments: list, out_dir: Path):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / "field_profile.npy", prof)
+    (out_dir / "field_segments.json").write_text(
+        json.dumps(segments, indent=2), encoding="utf-8"
+    )
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(__doc__)
+    p.add_argument("raw_file", help="Path to field.raw")
+    p.add_argument("-o", "--output-dir", default="pipeline_output")
+    p.add_argument("-w", "--window", type=int, default=WINDOW)
+    p.add_argument("-s", "--stride", type=int, default=STRIDE)
+    args = p.parse_args()
+
+    if not Path(args.raw_file).exists():
+        sys.exit(f"[ERROR] Raw file not found: {args.raw_file}")
+    prof = profile_field(args.raw_file, args.window, args.stride)
+    segs = detect_segments(prof, args.window)
+    save_profile(prof, segs, Path(args.output_dir))
+    print(f"[+] Profile: {len(prof)} windows, {len(segs)} segments → {args.output_dir}")
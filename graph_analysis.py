@@ -6,9 +6,15 @@ Graph statistics: saves graph_stats.json + degree_histogram.png.
 import json
 from pathlib import Path
 import networkx as nx
-import matplotlib.pyplot as plt
-
-def analyze_graph(G: nx.DiGraph, out_dir: Path):
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+def analyze_graph(G: nx.DiGraph, out_dir: Path, betweenness_k: int = None):
+    """
+    betweenness_k: None — точная betweenness (O(V·E)); k > 0 — оценка
+    по k случайным источникам; 0 — не считать.
+    Гистограмма рисуется через Agg без pyplot — можно вызывать из потока.
+    """
     stats = {
         "num_nodes": G.number_of_nodes(),
         "num_edges": G.number_of_edges()
@@ -25,9 +31,13 @@ def analyze_graph(G: nx.DiGraph, out_dir: Path):
     stats["largest_component_size"]  = max((len(c) for c in comps), default=0)
 
     dc = nx.degree_centrality(G)
-    bc = nx.betweenness_centrality(G)
     stats["top5_by_degree"]      = sorted(dc.items(), key=lambda x:-x[1])[:5]
-    stats["top5_by_betweenness"] = sorted(bc.items(), key=lambda x:-x[1])[:5]
+    if betweenness_k != 0:
+        k  = None if betweenness_k is None or betweenness_k >= len(G) else betweenness_k
+        bc = nx.betweenness_centrality(G, k=k, seed=42 if k else None)
+        stats["top5_by_betweenness"] = sorted(bc.items(), key=lambda x:-x[1])[:5]
+        if k:
+            stats["betweenness_sample"] = k
 
     out_dir.mkdir(parents=True, exist_ok=True)
     (out_dir / "graph_stats.json").write_text(
@@ -35,13 +45,14 @@ def analyze_graph(G: nx.DiGraph, out_dir: Path):
     )
 
     degs = [d for _,d in G.degree()]
-    plt.figure(figsize=(6,4))
-    plt.hist(degs, bins=20, color="steelblue", edgecolor="black")
-    plt.title("Degree distribution")
-    plt.xlabel("Degree")
-    plt.ylabel("Count")
-    plt.tight_layout()
-    plt.savefig(out_dir / "degree_histogram.png", dpi=150)
-    plt.close()
+    fig = Figure(figsize=(6,4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.hist(degs, bins=20, color="steelblue", edgecolor="black")
+    ax.set_title("Degree distribution")
+    ax.set_xlabel("Degree")
+    ax.set_ylabel("Count")
+    fig.tight_layout()
+    fig.savefig(out_dir / "degree_histogram.png", dpi=150)
 
     return stats
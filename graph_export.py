@@ -11,37 +11,87 @@ import uuid
 import random
 import networkx as nx
 import matplotlib.pyplot as plt
+from bisect import bisect_left, bisect_right
 from pathlib import Path
 
+from metadata_store import MetadataStore, is_db_path, open_metadata
+
+FRAG_SIZE = 128
+
+
+def fragment_meta_from_path(p: Path) -> dict:
+    """Метаданные, которые можно угадать по пути фрагмента без metadata.json."""
+    # wave из папки wave_N
+    wave = None
+    if p.parent.name.startswith("wave_"):
+        try:
+            wave = int(p.parent.name.split("_", 1)[1])
+        except ValueError:
+            pass
+
+    # offset: число перед .bin
+    try:
+        offset = int(p.name.split("_")[-2])
+    except Exception:
+        offset = None
+
+    return {
+        "wave":             wave,
+        "offset":           offset,
+        "transform_chain": ["identity"]
+    }
+
 
 def synthesize_metadata(fragments_dir: Path, out_meta: Path, logger) -> Path:
     logger.info("Автогенерация метаданных %s", out_meta)
-    meta = {}
-    for p in fragments_dir.rglob("*.bin"):
-        # wave из папки wave_N
-        wave = None
-        if p.parent.name.startswith("wave_"):
-            try:
-                wave = int(p.parent.name.split("_", 1)[1])
-            except ValueError:
-                pass
-
-        # offset: число перед .bin
-        try:
-            offset = int(p.name.split("_")[-2])
-        except Exception:
-            offset = None
-
-        meta[p.name] = {
-            "wave":             wave,
-            "offset":           offset,
-            "transform_chain": ["identity"]
-        }
+    meta = {p.name: fragment_meta_from_path(p) for p in fragments_dir.rglob("*.bin")}
+    if is_db_path(out_meta):
+        with MetadataStore(out_meta) as store:
+            store.insert_many(meta)
+        return out_meta
     out_meta.parent.mkdir(parents=True, exist_ok=True)
     out_meta.write_text(json.dumps(meta, indent=2), encoding="utf-8")
     return out_meta
 
 
+def add_fragments(G: nx.DiGraph, metas, node_attrs: list, edge_attrs: list):
+    """
+    Добавляет fragment-узлы, их seed-узлы и рёбра seed→fragment.
+    metas — dict/MetadataStore {fname: meta} или список пар (fname, meta).
+    Возвращает (множество seed-ов, число рёбер).
+    """
+    def items():
+        return metas.items() if hasattr(metas, "items") else metas
+
+    # сначала добавляем все fragment-узлы и их атрибуты
+    seeds = set()
+    for fname, m in items():
+        G.add_node(fname)
+        for a in node_attrs:
+            if a in m:
+                G.nodes[fname][a] = m[a]
+        if m.get("seed"):
+            seeds.add(m["seed"])
+
+    # теперь добавляем все уникальные seed-узлы
+    for sd in seeds:
+        G.add_node(sd)
+        # помечаем узел как настоящий seed
+        G.nodes[sd]["is_real_seed"] = True
+
+    # реальные seed→fragment рёбра
+    cnt = 0
+    for fname, m in items():
+        sd = m.get("seed")
+        if sd and sd in G and fname in G:
+            G.add_edge(sd, fname)
+            for a in edge_attrs:
+                if a in m:
+                    G.edges[sd, fname][a] = m[a]
+            cnt += 1
+    return seeds, cnt
+
+
 def build_graph(
     meta_json: Path,
     batch_json: Path,
@@ -53,7 +103,8 @@ def build_graph(
     fallback_random_seeds_count: int,
     add_cycle: bool,
     echo_enabled: bool,
-    logger=None
+    logger=None,
+    seed_index=None
 ) -> nx.DiGraph:
     G = nx.DiGraph()
 
@@ -70,47 +121,39 @@ def build_graph(
         logger.info("Nodes from batch: %d", G.number_of_nodes())
 
     # 2) Meta-узлы + добавление seed-узлов
-    metas = {}
-    if meta_json.exists():
-        metas = json.loads(meta_json.read_text(encoding="utf-8"))
-    else:
-        if logger:
-            logger.warning("metadata.json not found: %s", meta_json)
-
-    # сначала добавляем все fragment-узлы и их атрибуты
-    for fname, m in metas.items():
-        G.add_node(fname)
-        for a in node_attrs:
-            if a in m:
-                G.nodes[fname][a] = m[a]
-
-    # теперь добавляем все уникальные seed-узлы
-    real_seeds = set()
-    for m in metas.values():
-        sd = m.get("seed")
-        if sd:
-            real_seeds.add(sd)
-    for sd in real_seeds:
-        G.add_node(sd)
-        # помечаем узел как настоящий seed
-        G.nodes[sd]["is_real_seed"] = True
+    if not meta_json.exists() and logger:
+        logger.warning("metadata not found: %s", meta_json)
+    metas = open_metadata(meta_json)
 
+    # 3) fragment- и seed-узлы, реальные seed→fragment рёбра
+    real_seeds, cnt = add_fragments(G, metas, node_attrs, edge_attrs)
     if logger:
         logger.info("Meta-nodes: %d, real seeds: %d", len(metas), len(real_seeds))
-
-    # 3) Реальные seed→fragment рёбра
-    cnt = 0
-    for fname, m in metas.items():
-        sd = m.get("seed")
-        if sd and sd in G and fname in G:
-            G.add_edge(sd, fname)
-            for a in edge_attrs:
-                if a in m:
-                    G.edges[sd, fname][a] = m[a]
-            cnt += 1
-    if logger:
         logger.info("Seed→fragment edges: %d", cnt)
 
+    # 3b) Все вхождения seed в field.raw (по seed_index), не только выровненные:
+    # связываем seed с каждым фрагментом, целиком содержащим вхождение
+    if seed_index is not None:
+        spans = sorted(
+            (m["offset"], fname) for fname, m in metas.items()
+            if m.get("offset") is not None and fname in G
+        )
+        span_offs = [o for o, _ in spans]
+        occ = 0
+        for sd in real_seeds:
+            offsets = seed_index.offsets_for_seed(sd)
+            G.nodes[sd]["occurrences"] = len(offsets)
+            for so in map(int, offsets):
+                lo = bisect_left(span_offs, so + seed_index.window - FRAG_SIZE)
+                hi = bisect_right(span_offs, so)
+                for _, fname in spans[lo:hi]:
+                    if G.has_edge(sd, fname):
+                        continue
+                    G.add_edge(sd, fname, edge_type="seed_occurrence", seed_offset=so)
+                    occ += 1
+        if logger:
+            logger.info("Seed occurrence edges: %d", occ)
+
     # 4) Дополнительные «шумы», если включены
     # (connect_clusters, fallback, cycle, echo) — ваш прежний код
     # он сейчас не сработает при config:
@@ -121,9 +164,8 @@ def build_graph(
 
     if connect_clusters and "cluster_seeds" in G.graph:
         for s in G.graph["cluster_seeds"]:
-            for fname, m in metas.items():
-                if m.get("seed") == s:
-                    G.add_edge(s, fname, cluster_link=True)
+            for fname, _ in metas.by_seed(s):
+                G.add_edge(s, fname, cluster_link=True)
         if logger:
             logger.info("Cluster links added")
 
@@ -183,6 +225,7 @@ def build_graph(
         if logger:
             logger.info("Echo edges added: %d", count)
 
+    metas.close()
     return G
 
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+metadata_store.py
+
+Метаданные фрагментов в SQLite (WAL) вместо одного большого metadata.json.
+Индексированные колонки: wave, seed, offset, pulse_index, transform;
+полная запись фрагмента лежит в JSON-колонке data.
+
+MetadataStore ведёт себя как read-only dict {fname: meta}, поэтому
+старый код (metas.items(), metas.get(fn)) работает без изменений,
+а выборки по seed/смещению идут через индексы.
+"""
+
+import os, sys, json, sqlite3, argparse
+from pathlib import Path
+
+DB_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fragments (
+    name        TEXT PRIMARY KEY,
+    wave        INTEGER,
+    seed        TEXT,
+    offset      INTEGER,
+    pulse_index INTEGER,
+    transform   TEXT,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_fragments_wave      ON fragments(wave);
+CREATE INDEX IF NOT EXISTS ix_fragments_seed      ON fragments(seed);
+CREATE INDEX IF NOT EXISTS ix_fragments_offset    ON fragments(offset);
+CREATE INDEX IF NOT EXISTS ix_fragments_pulse     ON fragments(pulse_index);
+CREATE INDEX IF NOT EXISTS ix_fragments_transform ON fragments(transform);
+"""
+
+
+def is_db_path(path) -> bool:
+    return Path(path).suffix.lower() in DB_SUFFIXES
+
+
+def _row(name: str, meta: dict) -> tuple:
+    chain = meta.get("transform_chain") or []
+    return (
+        name,
+        meta.get("wave"),
+        meta.get("seed"),
+        meta.get("offset"),
+        meta.get("pulse_index"),
+        "+".join(chain),
+        json.dumps(meta),
+    )
+
+
+class MetadataStore:
+    """SQLite-хранилище метаданных; path=":memory:" — временная база."""
+
+    def __init__(self, path=":memory:"):
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        if self.path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- запись ---
+
+    def insert_many(self, metas) -> int:
+        """Пакетная вставка {fname: meta} или [(fname, meta)] одной транзакцией."""
+        items = metas.items() if isinstance(metas, dict) else metas
+        with self.conn:
+            cur = self.conn.executemany(
+                "INSERT OR REPLACE INTO fragments VALUES (?,?,?,?,?,?,?)",
+                (_row(n, m) for n, m in items)
+            )
+        return cur.rowcount
+
+    def import_json(self, json_path: Path) -> int:
+        metas = json.loads(Path(json_path).read_text(encoding="utf-8"))
+        return self.insert_many(metas)
+
+    def export_json(self, json_path: Path):
+        json_path = Path(json_path)
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        # через временный файл: параллельные экспорты не оставят обрывок
+        tmp = json_path.with_name(f"{json_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(dict(self.items()), indent=2), encoding="utf-8")
+        tmp.replace(json_path)
+
+    # --- dict-совместимое чтение ---
+
+    def _select(self, where: str = "", args: tuple = ()):
+        cur = self.conn.execute(f"SELECT name, data FROM fragments {where}", args)
+        for name, data in cur:
+            yield name, json.loads(data)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM fragments").fetchone()[0]
+
+    def __contains__(self, name):
+        return self.conn.execute(
+            "SELECT 1 FROM fragments WHERE name = ?", (name,)
+        ).fetchone() is not None
+
+    def __iter__(self):
+        return (n for n, _ in self.conn.execute("SELECT name FROM fragments ORDER BY name"))
+
+    def __getitem__(self, name):
+        row = self.conn.execute(
+            "SELECT data FROM fragments WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return self._select("ORDER BY name")
+
+    def values(self):
+        return (m for _, m in self.items())
+
+    # --- индексированные выборки ---
+
+    def by_seed(self, seed: str):
+        return self._select("WHERE seed = ? ORDER BY offset", (seed,))
+
+    def by_wave(self, wave: int):
+        return self._select("WHERE wave = ? ORDER BY offset", (wave,))
+
+    def by_transform(self, transform_chain: list):
+        return self._select("WHERE transform = ? ORDER BY name", ("+".join(transform_chain),))
+
+    def in_offset_range(self, lo: int, hi: int):
+        """Фрагменты с lo <= offset < hi."""
+        return self._select("WHERE offset >= ? AND offset < ? ORDER BY offset", (lo, hi))
+
+    def seeds(self) -> list:
+        return [r[0] for r in self.conn.execute(
+            "SELECT DISTINCT seed FROM fragments WHERE seed IS NOT NULL ORDER BY seed"
+        )]
+
+    def column_rows(self) -> dict:
+        """
+        fname → (wave, seed, offset, pulse_index, transform,
+                 hamming_distance, detection_score) — без разбора JSON в Python.
+        """
+        cur = self.conn.execute(
+            "SELECT name, wave, seed, offset, pulse_index, transform,"
+            " json_extract(data, '$.hamming_distance'),"
+            " json_extract(data, '$.detection_score') FROM fragments"
+        )
+        return {r[0]: r[1:] for r in cur}
+
+    def max_offset(self):
+        return self.conn.execute("SELECT MAX(offset) FROM fragments").fetchone()[0]
+
+
+def open_metadata(path) -> MetadataStore:
+    """
+    .db/.sqlite — открываем хранилище как есть;
+    .json — импортируем в in-memory базу (совместимость со старым форматом).
+    Отсутствующий файл — пустая in-memory база: чтение не создаёт файлов.
+    """
+    path = Path(path)
+    if is_db_path(path) and path.exists():
+        return MetadataStore(path)
+    store = MetadataStore()
+    if path.exists():
+        store.import_json(path)
+    return store
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(__doc__)
+    sub = p.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="metadata.json → metadata.db")
+    imp.add_argument("json_path"); imp.add_argument("db_path")
+    exp = sub.add_parser("export", help="metadata.db → metadata.json")
+    exp.add_argument("db_path"); exp.add_argument("json_path")
+    args = p.parse_args()
+
+    if args.cmd == "import":
+        if not Path(args.json_path).exists():
+            sys.exit(f"[ERROR] JSON not found: {args.json_path}")
+        with MetadataStore(args.db_path) as st:
+            n = st.import_json(Path(args.json_path))
+        print(f"[+] Imported {n} records → {args.db_path}")
+    else:
+        with MetadataStore(args.db_path) as st:
+            st.export_json(Path(args.json_path))
+        print(f"[+] Exported → {args.json_path}")
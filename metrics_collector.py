@@ -1,37 +1,211 @@
 # metrics_collector.py
 
-import os, json
+import os
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
+from pandas.api.types import union_categoricals
 from scipy.stats import entropy
 
+from metadata_store import open_metadata
+
 def shannon_entropy(data: bytes) -> float:
-    counts = pd.Series(list(data)).value_counts(normalize=True)
-    return entropy(counts, base=2)
+    counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    return entropy(counts[counts > 0], base=2) if len(data) else 0.0
+
+
+# --- колоночный сбор метрик ---
+
+CHUNK_ROWS = 1 << 16
+
+# числовые колонки и их типы; целые из метаданных — nullable (маска)
+NUMERIC = {
+    "size":             np.uint32,
+    "entropy":          np.float32,
+    "wave":             np.uint8,
+    "offset":           np.uint32,
+    "pulse_index":      np.uint16,
+    "hamming_distance": np.uint16,
+    "detection_score":  np.float32,
+}
+NULLABLE    = ("wave", "offset", "pulse_index", "hamming_distance")
+CATEGORICAL = ("wave_dir", "seed", "transform")
+COLUMNS     = ("path", "wave_dir", "size", "entropy", "wave", "seed", "offset",
+               "pulse_index", "transform", "hamming_distance", "detection_score")
+
+
+class MetricsAccumulator:
+    """
+    Копит метрики в заранее выделенные типизированные массивы по chunk_size
+    строк; seed/transform/wave_dir — коды общего словаря категорий.
+    С spill_dir заполненные чанки уходят на диск (по .npy на колонку),
+    в памяти — один.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_ROWS, spill_dir: str = None):
+        self.chunk_size = chunk_size
+        self.spill_dir  = Path(spill_dir) if spill_dir else None
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._cats   = {c: {} for c in CATEGORICAL}
+        self._chunks = []
+        self._rows   = 0
+        self._new_chunk()
+
+    def __len__(self):
+        return self._rows
+
+    def _new_chunk(self):
+        n = self.chunk_size
+        self._buf = {c: np.zeros(n, dtype=t) for c, t in NUMERIC.items()}
+        for c in NULLABLE:
+            self._buf[f"{c}__na"] = np.ones(n, dtype=bool)
+        for c in CATEGORICAL:
+            self._buf[c] = np.full(n, -1, dtype=np.int32)
+        self._buf["path"] = np.empty(n, dtype=object)
+        self._n = 0
+
+    def _code(self, col, value):
+        if value is None:
+            return -1
+        return self._cats[col].setdefault(value, len(self._cats[col]))
+
+    def append(self, path: str, wave_dir: str, size: int, entropy: float,
+               wave=None, seed=None, offset=None, pulse_index=None,
+               transform=None, hamming_distance=None, detection_score=None):
+        i, b = self._n, self._buf
+        b["path"][i]     = path
+        b["wave_dir"][i] = self._code("wave_dir", wave_dir)
+        b["seed"][i]     = self._code("seed", seed)
+        b["transform"][i] = self._code("transform", transform)
+        b["size"][i]     = size
+        b["entropy"][i]  = entropy
+        b["detection_score"][i] = np.nan if detection_score is None else detection_score
+        for c, v in (("wave", wave), ("offset", offset),
+                     ("pulse_index", pulse_index), ("hamming_distance", hamming_distance)):
+            if v is not None:
+                b[c][i] = v
+                b[f"{c}__na"][i] = False
+        self._n += 1
+        self._rows += 1
+        if self._n == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._n:
+            return
+        chunk = {c: a[:self._n] for c, a in self._buf.items()}
+        if self.spill_dir:
+            spill = self.spill_dir / f"metrics_{len(self._chunks):05d}"
+            spill.mkdir(exist_ok=True)
+            for c, a in chunk.items():
+                # path — строки фиксированной ширины, чтобы читать через mmap
+                np.save(spill / f"{c}.npy", a.astype(str) if a.dtype == object else a)
+            chunk = spill
+        self._chunks.append(chunk)
+        self._new_chunk()
 
-def collect_metrics(frag_dir: str, meta_path: str = None) -> pd.DataFrame:
+    def _column(self, name, dtype) -> np.ndarray:
+        # одна колонка всех чанков в заранее выделенный массив;
+        # прочитанная часть чанка сразу освобождается
+        out, pos = np.empty(self._rows, dtype=dtype), 0
+        for chunk in self._chunks:
+            if isinstance(chunk, Path):
+                f = chunk / f"{name}.npy"
+                part = np.load(f, mmap_mode="r")
+                out[pos: pos + len(part)] = part
+                pos += len(part)
+                del part
+                f.unlink()
+            else:
+                part = chunk.pop(name)
+                out[pos: pos + len(part)] = part
+                pos += len(part)
+        return out
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Собирает DataFrame колонка за колонкой (спилленные файлы удаляются):
+        кроме готовых колонок в памяти только одна колонка одного чанка.
+        """
+        self._flush()
+        cols = {"path": self._column("path", object)}
+        for c in CATEGORICAL:
+            cols[c] = pd.Categorical.from_codes(self._column(c, np.int32), list(self._cats[c]))
+        for c, t in NUMERIC.items():
+            vals = self._column(c, t)
+            cols[c] = pd.arrays.IntegerArray(vals, self._column(f"{c}__na", bool)) \
+                if c in NULLABLE else vals
+        for chunk in self._chunks:
+            if isinstance(chunk, Path):
+                chunk.rmdir()
+        self._chunks, self._rows = [], 0
+        return pd.DataFrame({c: cols[c] for c in COLUMNS}, copy=False)
+
+
+def meta_columns(meta: dict) -> dict:
+    """Поля записи metadata.json → keyword-аргументы MetricsAccumulator.append."""
+    chain = meta.get("transform_chain") or []
+    return {
+        "wave":             meta.get("wave"),
+        "seed":             meta.get("seed"),
+        "offset":           meta.get("offset"),
+        "pulse_index":      meta.get("pulse_index"),
+        "transform":        "+".join(chain) or None,
+        "hamming_distance": meta.get("hamming_distance"),
+        "detection_score":  meta.get("detection_score"),
+    }
+
+
+def concat_metrics(frames: list) -> pd.DataFrame:
+    # pd.concat превращает категории с разными словарями в object — объединяем явно
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame()
+    if any(list(f.columns) != list(frames[0].columns) for f in frames):
+        return pd.concat(frames, ignore_index=True)
+    cols = {}
+    for c in frames[0].columns:
+        parts = [f[c] for f in frames]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            # пустой словарь категорий имеет другой dtype — приводим к object
+            cols[c] = union_categoricals([
+                p.cat.set_categories(p.cat.categories.astype(object)) for p in parts
+            ])
+        else:
+            cols[c] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(cols)
+
+
+def collect_metrics(frag_dir: str, meta_path: str = None,
+                    chunk_size: int = CHUNK_ROWS, spill_dir: str = None) -> pd.DataFrame:
     metas = {}
     if meta_path and os.path.exists(meta_path):
-        metas = json.load(open(meta_path, "r", encoding="utf-8"))
+        store = open_metadata(meta_path)
+        metas = store.column_rows()
+        store.close()
 
-    records = []
+    acc = MetricsAccumulator(chunk_size, spill_dir)
     for root, _, files in os.walk(frag_dir):
+        wave_dir = os.path.basename(root)
         for fn in files:
             if not fn.endswith(".bin"):
                 continue
             p = os.path.join(root, fn)
-            data = open(p, "rb").read()
-            rec = {
-                "path": p,
-                "size": len(data),
-                "entropy": shannon_entropy(data),
-            }
+            with open(p, "rb") as f:
+                data = f.read()
             # в meta могут быть offset, hamming_distance, pulse_index, detection_score
-            rec.update(metas.get(fn, {}))
-            records.append(rec)
+            m = metas.get(fn)
+            if m:
+                acc.append(p, wave_dir, len(data), shannon_entropy(data),
+                           *(v if v != "" else None for v in m))
+            else:
+                acc.append(p, wave_dir, len(data), shannon_entropy(data))
 
-    return pd.DataFrame(records)
+    return acc.to_frame()
 
 
 def plot_metrics(df, out_dir, x_col, y_col, hue_col=None):
@@ -57,3 +231,193 @@ def plot_metrics(df, out_dir, x_col, y_col, hue_col=None):
         plt.title("Частота инверсий по волнам")
         plt.savefig(f"{out_dir}/invert_heatmap.png")
         plt.close()
+
+
+# --- aggregate-first режим: агрегаты на NumPy, отрисовка в пуле процессов ---
+
+HIST_BINS  = 50
+HUE_LEVELS = 8          # непрерывный hue режем на столько интервалов
+QUANTILES  = (0.25, 0.5, 0.75)
+
+
+def _codes(values: pd.Series, bin_continuous: bool = False):
+    """Коды групп + подписи; непрерывный hue с кучей значений — интервалы."""
+    if (bin_continuous and values.dtype.kind == "f"
+            and values.nunique() > HUE_LEVELS):
+        values = pd.cut(values, HUE_LEVELS)
+    codes, labels = pd.factorize(values, sort=True)
+    return codes, [_label(l) for l in labels]
+
+
+def _label(v) -> str:
+    # wave приходит float из-за NaN у фрагментов без метаданных
+    return str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+
+
+def _group_quantiles(codes: np.ndarray, vals: np.ndarray, ngroups: int, qs):
+    """Квантили по группам одной сортировкой; NaN там, где группа пуста."""
+    order  = np.lexsort((vals, codes))
+    codes, vals = codes[order], vals[order]
+    counts = np.bincount(codes, minlength=ngroups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    out = np.full((len(qs) + 2, ngroups), np.nan)
+    ok  = counts > 0
+    for i, q in enumerate(qs):
+        pos  = starts[ok] + q * (counts[ok] - 1)
+        lo   = np.floor(pos).astype(np.int64)
+        hi   = np.minimum(lo + 1, starts[ok] + counts[ok] - 1)
+        frac = pos - lo
+        out[i, ok] = vals[lo] * (1 - frac) + vals[hi] * frac
+    out[-2, ok] = vals[starts[ok]]                       # min
+    out[-1, ok] = vals[starts[ok] + counts[ok] - 1]      # max
+    return out, counts
+
+
+def aggregate_metrics(df, x_col, y_col, hue_col=None, bins: int = HIST_BINS) -> dict:
+    """
+    Сворачивает покадровый DataFrame в агрегаты: квантили для box plot,
+    гистограммы с фиксированными бинами и матрицу частот для heatmap.
+    Размер результата зависит от числа групп, а не строк.
+    """
+    cols = [c for c in (x_col, y_col, hue_col) if c]
+    d = df.dropna(subset=cols)
+    y = pd.to_numeric(d[y_col], errors="coerce").to_numpy(dtype=np.float64)
+    d, y = d[~np.isnan(y)], y[~np.isnan(y)]
+
+    xc, x_labels = _codes(d[x_col])
+    if hue_col:
+        hc, hue_labels = _codes(d[hue_col], bin_continuous=True)
+    else:
+        hc, hue_labels = np.zeros(len(d), dtype=np.int64), [None]
+    nx_, nh = len(x_labels), len(hue_labels)
+
+    # box: квантили по (x, hue)
+    q, counts = _group_quantiles(xc * nh + hc, y, nx_ * nh, QUANTILES)
+    box = {
+        "q1": q[0].reshape(nx_, nh), "med": q[1].reshape(nx_, nh),
+        "q3": q[2].reshape(nx_, nh), "min": q[3].reshape(nx_, nh),
+        "max": q[4].reshape(nx_, nh), "count": counts.reshape(nx_, nh),
+    }
+
+    # hist: общие бины, счётчики по hue
+    if len(y):
+        edges = np.histogram_bin_edges(y, bins=bins)
+        b = np.clip(np.searchsorted(edges, y, side="right") - 1, 0, len(edges) - 2)
+        hist = np.bincount(hc * (len(edges) - 1) + b,
+                           minlength=nh * (len(edges) - 1)).reshape(nh, -1)
+    else:
+        edges, hist = np.array([0.0, 1.0]), np.zeros((nh, 1), dtype=np.int64)
+
+    aggs = {
+        "x_col": x_col, "y_col": y_col, "hue_col": hue_col,
+        "x_labels": x_labels, "hue_labels": hue_labels,
+        "box": box, "hist": hist, "edges": edges,
+    }
+
+    if "invert" in df.columns:
+        h = df.dropna(subset=["wave", "invert"])
+        wc, w_labels = pd.factorize(h["wave"], sort=True)
+        ic, i_labels = pd.factorize(h["invert"], sort=True)
+        aggs["heatmap"] = {
+            "counts": np.bincount(wc * len(i_labels) + ic,
+                                  minlength=len(w_labels) * len(i_labels)
+                                  ).reshape(len(w_labels), len(i_labels)),
+            "rows": [_label(l) for l in w_labels],
+            "cols": [_label(l) for l in i_labels],
+        }
+    return aggs
+
+
+def _render_box(aggs: dict, out_png: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    box, nh = aggs["box"], len(aggs["hue_labels"])
+    width   = 0.8 / nh
+    colors  = plt.cm.tab10.colors
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for h, label in enumerate(aggs["hue_labels"]):
+        stats, pos = [], []
+        for x in range(len(aggs["x_labels"])):
+            if not box["count"][x, h]:
+                continue
+            q1, q3 = box["q1"][x, h], box["q3"][x, h]
+            iqr = q3 - q1
+            stats.append({
+                "med": box["med"][x, h], "q1": q1, "q3": q3,
+                "whislo": max(box["min"][x, h], q1 - 1.5 * iqr),
+                "whishi": min(box["max"][x, h], q3 + 1.5 * iqr),
+                "fliers": [],
+            })
+            pos.append(x + (h - (nh - 1) / 2) * width)
+        if stats:
+            ax.bxp(stats, positions=pos, widths=width * 0.9, patch_artist=True,
+                   boxprops={"facecolor": colors[h % len(colors)]}, manage_ticks=False)
+            if label is not None:
+                ax.plot([], [], "s", color=colors[h % len(colors)], label=label)
+    ax.set_xticks(range(len(aggs["x_labels"])), aggs["x_labels"])
+    ax.set_xlabel(aggs["x_col"]); ax.set_ylabel(aggs["y_col"])
+    if aggs["hue_col"]:
+        ax.legend(title=aggs["hue_col"], fontsize="small")
+    ax.set_title(f"{aggs['y_col']} vs {aggs['x_col']}")
+    fig.savefig(out_png)
+    plt.close(fig)
+    return out_png
+
+
+def _render_hist(aggs: dict, out_png: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    edges, hist = aggs["edges"], aggs["hist"]
+    # density как у sns.histplot(common_norm=True): нормируем на все строки
+    dens = hist / max(hist.sum(), 1) / np.diff(edges)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for h, label in enumerate(aggs["hue_labels"]):
+        ax.stairs(dens[h], edges, label=label)
+    ax.set_xlabel(aggs["y_col"]); ax.set_ylabel("Density")
+    if aggs["hue_col"]:
+        ax.legend(title=aggs["hue_col"], fontsize="small")
+    ax.set_title(f"Distribution of {aggs['y_col']}")
+    fig.savefig(out_png)
+    plt.close(fig)
+    return out_png
+
+
+def _render_heatmap(hm: dict, out_png: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    sns.heatmap(pd.DataFrame(hm["counts"], index=hm["rows"], columns=hm["cols"]),
+                annot=True, fmt="d", ax=ax)
+    ax.set_title("Частота инверсий по волнам")
+    fig.savefig(out_png)
+    plt.close(fig)
+    return out_png
+
+
+def _render_jobs(aggs: dict, out_dir: str):
+    x_col, y_col = aggs["x_col"], aggs["y_col"]
+    jobs = [
+        (_render_box,  aggs, f"{out_dir}/{y_col}_by_{x_col}.png"),
+        (_render_hist, aggs, f"{out_dir}/{y_col}_distribution.png"),
+    ]
+    if "heatmap" in aggs:
+        jobs.append((_render_heatmap, aggs["heatmap"], f"{out_dir}/invert_heatmap.png"))
+    return jobs
+
+
+def plot_aggregates(aggs: dict, out_dir: str, executor=None):
+    """
+    Рисует графики по агрегатам. С executor (ProcessPoolExecutor) — сразу
+    возвращает список futures, отрисовка идёт в фоне; без него — синхронно.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = _render_jobs(aggs, out_dir)
+    if executor is None:
+        return [fn(a, png) for fn, a, png in jobs]
+    return [executor.submit(fn, a, png) for fn, a, png in jobs]
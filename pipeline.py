@@ -13,9 +13,16 @@ if hasattr(sys, "set_int_max_str_digits"):
 import yaml
 import logging
 import argparse
+import multiprocessing as mp
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-from metrics_collector    import collect_metrics, plot_metrics
+from metrics_collector    import (
+    collect_metrics,
+    plot_metrics,
+    aggregate_metrics,
+    plot_aggregates
+)
 from batch_analysis       import batch_analyze, save_results
 from cluster_resonance    import load_batch_results, cluster_and_select
 from graph_export         import (
@@ -25,6 +32,13 @@ from graph_export         import (
     export_graphml
 )
 from graph_analysis       import analyze_graph
+from seed_index           import build_seed_index
+from field_profile        import (
+    profile_field,
+    detect_segments,
+    adaptive_wave_offsets,
+    save_profile
+)
 
 
 def setup_logging():
@@ -76,9 +90,37 @@ def main():
 
     p = argparse.ArgumentParser("Resonance Pipeline")
     p.add_argument("--config","-c", default="config.yaml", help="YAML config file")
+    p.add_argument("--corpus", help="Directory or manifest of raw fields (corpus mode)")
+    p.add_argument("--shards-only", action="store_true",
+                   help="Corpus mode: write per-field shards, skip merge")
+    p.add_argument("--watch", action="store_true",
+                   help="Service mode: poll inputs and update outputs incrementally")
     args = p.parse_args()
 
     cfg       = load_config(args.config, logger)
+
+    # сервисный режим: инкрементальные обновления до Ctrl+C
+    if args.watch:
+        import asyncio
+        from watch import run_watch
+        try:
+            asyncio.run(run_watch(cfg, logger))
+        except KeyboardInterrupt:
+            logger.info("Watch: остановлен")
+        return
+
+    # режим корпуса: все поля в одном пуле процессов + merge
+    if args.corpus:
+        from corpus import run_corpus
+        stats = run_corpus(args.corpus, cfg, logger, shards_only=args.shards_only)
+        if stats:
+            logger.info(
+                "Corpus graph stats: Nodes=%d Edges=%d Comps=%d Largest=%d",
+                stats["num_nodes"], stats["num_edges"],
+                stats["num_components"], stats["largest_component_size"]
+            )
+        return
+
     raw_file  = cfg["raw_file"]
     frags_dir = Path(cfg["fragments_dir"])
     meta_file = Path(cfg["metadata_file"])
@@ -97,32 +139,68 @@ def main():
     out_dir.mkdir(parents=True, exist_ok=True)
     plot_dir.mkdir(parents=True, exist_ok=True)
 
-    # 0) extract fragments, если raw_file задан
+    # 0) профиль энтропии поля + extract fragments, если raw_file задан
     if raw_file:
         rf = Path(raw_file)
         if rf.exists():
+            wave_offsets = None
+            if cfg.get("field_profile"):
+                window = int(cfg.get("profile_window", 256))
+                prof = profile_field(raw_file, window, int(cfg.get("profile_stride", 64)))
+                segs = detect_segments(prof, window)
+                save_profile(prof, segs, out_dir)
+                logger.info("Профиль поля: %d окон, %d сегментов", len(prof), len(segs))
+                if cfg.get("adaptive_offsets"):
+                    wave_offsets = adaptive_wave_offsets(segs) or None
+                    logger.info("Адаптивные смещения волн: %s", wave_offsets)
+
             from resonant_extract import extract_fragments
-            extract_fragments(raw_file)
+            extract_fragments(raw_file, wave_offsets,
+                              export_json=cfg.get("metadata_json_export", True))
         else:
             logger.warning("Raw-файл '%s' не найден — пропускаем extract", raw_file)
 
-    # 0.5) synthesize metadata, если его нет
+    # 0.25) rolling-hash индекс повторяющихся seed-окон
+    seed_idx = None
+    if cfg.get("seed_index") and raw_file and Path(raw_file).exists():
+        seed_idx = build_seed_index(
+            raw_file, shards=int(cfg.get("seed_index_shards", 0)), logger=logger
+        )
+        seed_idx.save(out_dir / "seed_index.json")
+        logger.info("Seed index: %d повторяющихся окон", len(seed_idx))
+
+    # 0.5) metadata.json рядом с отсутствующей базой, иначе synthesize
+    if not meta_file.exists() and meta_file.with_suffix(".json").exists():
+        meta_file = meta_file.with_suffix(".json")
+        logger.info("Метаданные: %s (базы нет, берём JSON)", meta_file)
     if not meta_file.exists():
-        auto_meta = out_dir / "metadata.auto.json"
+        auto_meta = out_dir / f"metadata.auto{meta_file.suffix or '.json'}"
         meta_file = synthesize_metadata(frags_dir, auto_meta, logger)
 
     # 1) Метрики + графики
-    df = collect_metrics(str(frags_dir), str(meta_file))
+    df = collect_metrics(str(frags_dir), str(meta_file),
+                         spill_dir=cfg.get("metrics_spill_dir"))
     logger.info("Метрик собрано: %d", len(df))
 
+    plot_pool, plot_futures = None, []
     if not df.empty:
         x_col   = guess_column(df, cfg["x_col"], logger)
         y_col   = guess_column(df, cfg["y_col"], logger)
         hue_col = cfg["hue_col"] if cfg["hue_col"] in df.columns else None
 
-        plot_metrics(df, str(plot_dir),
-                     x_col=x_col, y_col=y_col, hue_col=hue_col)
-        logger.info("Графики сохранены в %s", plot_dir)
+        if cfg.get("plot_mode", "aggregate") == "aggregate":
+            # агрегаты считаем здесь, рисуем в фоне — batch/cluster не ждут
+            aggs = aggregate_metrics(df, x_col, y_col, hue_col)
+            plot_pool = ProcessPoolExecutor(
+                max_workers=int(cfg.get("plot_workers", 2)),
+                mp_context=mp.get_context("spawn")
+            )
+            plot_futures = plot_aggregates(aggs, str(plot_dir), executor=plot_pool)
+            logger.info("Графики (%d) отправлены в пул отрисовки", len(plot_futures))
+        else:
+            plot_metrics(df, str(plot_dir),
+                         x_col=x_col, y_col=y_col, hue_col=hue_col)
+            logger.info("Графики сохранены в %s", plot_dir)
     else:
         logger.warning("Нет данных для графиков, пропускаем")
 
@@ -140,6 +218,16 @@ def main():
     logger.info("Кластеры сохранены: %s", cluster_path)
     logger.info("New seeds: %s", seeds or "none")
 
+    # дожидаемся фоновой отрисовки графиков
+    if plot_pool:
+        for fut in plot_futures:
+            try:
+                fut.result()
+            except Exception as e:
+                logger.error("Ошибка отрисовки графика: %s", e)
+        plot_pool.shutdown()
+        logger.info("Графики сохранены в %s", plot_dir)
+
     # 4) Построение и экспорт графа
     G = build_graph(
         meta_file,
@@ -152,7 +240,8 @@ def main():
         cfg["fallback_random_seeds_count"],
         cfg["add_cycle"],
         cfg["echo_enabled"],
-        logger
+        logger,
+        seed_index=seed_idx
     )
     G.graph["cluster_seeds"] = seeds
 
@@ -2,7 +2,7 @@
 """
 raw_reconstruct.py
 
-Восстанавливает field.raw из extracted/fragment + metadata.json.
+Восстанавливает field.raw из extracted/fragment + metadata.db (или metadata.json).
 Поднимает лимит на длину числа при необходимости.
 """
 
@@ -12,10 +12,10 @@ import sys
 if hasattr(sys, "set_int_max_str_digits"):
     sys.set_int_max_str_digits(30000)
 
-import json
-import re
 from pathlib import Path
 
+from metadata_store import open_metadata
+
 FRAG_SIZE = 128
 
 
@@ -34,18 +34,18 @@ def inverse_transform(data: bytes, ops):
 
 def reconstruct_raw(fragments_dir: Path, meta_path: Path, out_path: Path):
     if not meta_path.exists():
-        fallback = Path("pipeline_output/metadata.auto.json")
-        if fallback.exists():
+        fallbacks = [meta_path.with_suffix(".json"),
+                     Path("pipeline_output/metadata.auto.db"),
+                     Path("pipeline_output/metadata.auto.json")]
+        fallback = next((f for f in fallbacks if f.exists()), None)
+        if fallback:
             print(f"[!] metadata не найден, используем {fallback}", file=sys.stderr)
             meta_path = fallback
         else:
-            sys.exit(f"[ERROR] metadata.json не найден: {meta_path}")
+            sys.exit(f"[ERROR] metadata не найден: {meta_path}")
 
-    meta = json.loads(meta_path.read_text(encoding="utf-8"))
-    max_end = 0
-    for entry in meta.values():
-        off = entry.get("offset") or 0
-        max_end = max(max_end, off + FRAG_SIZE)
+    meta = open_metadata(meta_path)
+    max_end = (meta.max_offset() or 0) + FRAG_SIZE if len(meta) else 0
 
     buffer = bytearray(max_end)
     filled = bytearray(max_end)
@@ -65,6 +65,7 @@ def reconstruct_raw(fragments_dir: Path, meta_path: Path, out_path: Path):
             if pos < len(buffer) and filled[pos] == 0:
                 buffer[pos] = b
                 filled[pos] = 1
+    meta.close()
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_bytes(buffer)
@@ -76,7 +77,7 @@ if __name__ == "__main__":
 
     p = argparse.ArgumentParser(__doc__)
     p.add_argument("-d", "--fragments-dir", default="extracted")
-    p.add_argument("-m", "--metadata",      default="extracted/metadata.json")
+    p.add_argument("-m", "--metadata",      default="extracted/metadata.db")
     p.add_argument("-o", "--output",        default="recovered_field.raw")
     args = p.parse_args()
 
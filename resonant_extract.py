@@ -3,12 +3,15 @@
 resonant_extract.py
 
 Нарезает field.raw на фрагменты, применяет трансформации
-и сохраняет metadata.json с полем "seed" = SHA256 первых 16 байт блока.
+и сохраняет метаданные с полем "seed" = SHA256 первых 16 байт блока
+в extracted/metadata.db (+ экспорт metadata.json для совместимости).
 """
 
-import sys, json, hashlib, argparse
+import sys, hashlib, argparse
 from pathlib import Path
 
+from metadata_store import MetadataStore
+
 WAVES           = 5
 PULSES_PER_WAVE = 10
 SEED_SIZE       = 16
@@ -16,15 +19,17 @@ FRAG_SIZE       = 128
 
 EXTRACT_DIR = Path("extracted")
 META_FILE   = EXTRACT_DIR / "metadata.json"
+META_DB     = EXTRACT_DIR / "metadata.db"
 
-def load_meta() -> dict:
-    if META_FILE.exists():
-        return json.loads(META_FILE.read_text(encoding="utf-8"))
-    return {}
-
-def save_meta(meta: dict):
-    META_FILE.parent.mkdir(parents=True, exist_ok=True)
-    META_FILE.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+def save_meta(meta: dict, export_json: bool = True, extract_dir: Path = EXTRACT_DIR):
+    # одна транзакция на весь прогон; старый metadata.json подхватываем один раз
+    meta_file = extract_dir / META_FILE.name
+    with MetadataStore(extract_dir / META_DB.name) as store:
+        if not len(store) and meta_file.exists():
+            store.import_json(meta_file)
+        store.insert_many(meta)
+        if export_json:
+            store.export_json(meta_file)
 
 def hash_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()[:12]
@@ -34,26 +39,40 @@ def transformations(fragment: bytes):
     yield ("invert", bytes((~b & 0xFF) for b in fragment))
     yield ("xor",    bytes((b ^ 0xFF) for b in fragment))
 
-def extract_fragments(raw_file: str):
+def extract_fragments(raw_file: str, wave_offsets: list = None, export_json: bool = True,
+                      extract_dir: Path = None, namespace: str = None):
+    """
+    wave_offsets — стартовые смещения волн (например, из field_profile);
+    по умолчанию волны идут с шагом FRAG_SIZE от начала поля.
+    export_json — дублировать metadata.db в metadata.json.
+    extract_dir — куда писать фрагменты (по умолчанию EXTRACT_DIR);
+    namespace — префикс имён фрагментов и seed-ов (корпус из многих полей).
+    """
+    extract_dir = Path(extract_dir) if extract_dir else EXTRACT_DIR
+    prefix      = f"{namespace}__" if namespace else ""
     raw = Path(raw_file)
     if not raw.exists():
         print(f"[!] Raw file '{raw_file}' not found, skipping extract.", file=sys.stderr)
         return
     buf = raw.read_bytes()
-    meta = load_meta()
+    meta = {}
+
+    if wave_offsets is None:
+        wave_offsets = [wave * FRAG_SIZE for wave in range(WAVES)]
 
-    for wave in range(WAVES):
-        seed_off   = wave * FRAG_SIZE
+    for wave, seed_off in enumerate(wave_offsets):
         seed_bytes = buf[seed_off: seed_off + SEED_SIZE]
         seed_id    = hash_bytes(seed_bytes)
+        if namespace:
+            seed_id = f"{namespace}:{seed_id}"
 
         for pulse in range(PULSES_PER_WAVE):
-            offset = wave * FRAG_SIZE + pulse * (SEED_SIZE // 2)
+            offset = seed_off + pulse * (SEED_SIZE // 2)
             frag   = buf[offset: offset + FRAG_SIZE]
 
             for op, data in transformations(frag):
-                name = f"w{wave}_p{pulse}_{offset}_{op}.bin"
-                odir = EXTRACT_DIR / f"wave_{wave}"
+                name = f"{prefix}w{wave}_p{pulse}_{offset}_{op}.bin"
+                odir = extract_dir / f"wave_{wave}"
                 odir.mkdir(parents=True, exist_ok=True)
                 fpath = odir / name
                 fpath.write_bytes(data)
@@ -70,7 +89,9 @@ def extract_fragments(raw_file: str):
                     "hamming_distance": hd,
                     "detection_score":  score
                 }
-                save_meta(meta)
+                if namespace:
+                    meta[name]["field"] = namespace
+    save_meta(meta, export_json, extract_dir)
 
 if __name__=="__main__":
     p = argparse.ArgumentParser(__doc__)
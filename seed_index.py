@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+seed_index.py
+
+Rolling-hash (Rabin–Karp) индекс всех SEED_SIZE-байтовых окон field.raw.
+Находит повторяющиеся окна (seed-паттерны) на любом смещении,
+а не только на границах волн, как resonant_extract.
+
+Хеш окна — разность префиксных сумм, O(1) на окно при любой длине окна.
+Файл читается через memmap один раз: (h1, h2, смещение) каждого окна
+раскладываются по шардам на диске, и шарды сортируются по одному.
+"""
+
+import sys, json, argparse, tempfile
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from resonant_extract import SEED_SIZE, hash_bytes
+
+BASE1      = np.uint64(257)                    # основания двух независимых
+BASE2      = np.uint64(0x100000001B3)          # полиномиальных хешей (mod 2**64)
+CHUNK_SIZE    = 1 << 20                        # окон за один векторный проход
+SHARD_WINDOWS = 1 << 20                        # окон в шарде (20 байт на окно + сортировка)
+SHARD_SALT    = np.uint64(0x5EED1DE7)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    # splitmix64: равномерно разносим биты полиномиального хеша
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+@lru_cache(maxsize=4)
+def _powers(base: int, n: int) -> np.ndarray:
+    """base**k mod 2**64 для k = 0..n-1 (кэш: куски почти всегда одной длины)."""
+    p = np.full(n, base, dtype=np.uint64)
+    p[0] = 1
+    return np.cumprod(p, dtype=np.uint64)
+
+
+def _inverse(base: np.uint64) -> int:
+    # нечётное основание обратимо по модулю 2**64 (итерации Ньютона)
+    b = int(base)
+    x = b
+    for _ in range(6):
+        x = x * (2 - b * x) % (1 << 64)
+    return x
+
+
+def window_hashes(buf: np.ndarray, window: int, base: np.uint64 = BASE1) -> np.ndarray:
+    """
+    Полиномиальный хеш каждого окна длины window (как схема Горнера):
+    h(i) = base**(i+window-1) * (S[i+window] - S[i]), S — префиксные суммы
+    buf[j] * base**-j. Сдвиг окна стоит O(1), а не O(window).
+    """
+    n = len(buf) - window + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    s = np.zeros(len(buf) + 1, dtype=np.uint64)
+    np.cumsum(buf * _powers(_inverse(base), len(buf)), out=s[1:])
+    return (s[window:] - s[:n]) * _powers(int(base), len(buf))[window - 1:]
+
+
+def _chunks(mm: np.ndarray, window: int, chunk_size: int):
+    # куски с перекрытием window-1, чтобы не терять окна на стыках
+    total = len(mm) - window + 1
+    for start in range(0, max(total, 0), chunk_size):
+        stop = min(start + chunk_size, total)
+        yield start, mm[start: stop + window - 1]
+
+
+def _shard_ids(h1: np.ndarray, nshards: int) -> np.ndarray:
+    return (_mix(h1 ^ SHARD_SALT) % np.uint64(nshards)).astype(np.int64)
+
+
+def _run_lengths(*keys: np.ndarray) -> np.ndarray:
+    # длины серий одинаковых значений в отсортированных ключах
+    n = len(keys[0])
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    brk = np.zeros(n - 1, dtype=bool)
+    for k in keys:
+        brk |= k[1:] != k[:-1]
+    return np.diff(np.concatenate(([0], np.flatnonzero(brk) + 1, [n])))
+
+
+class SeedIndex:
+    """Повторяющиеся окна field.raw и все их смещения."""
+
+    def __init__(self, window: int, patterns: dict):
+        self.window   = window
+        self.patterns = patterns          # bytes → np.ndarray[uint64] смещений
+        self._by_seed = None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def lookup(self, pattern: bytes) -> np.ndarray:
+        """Смещения паттерна (пусто, если он не повторяется)."""
+        return self.patterns.get(bytes(pattern), np.empty(0, dtype=np.uint64))
+
+    def offsets_for_seed(self, seed_id: str) -> np.ndarray:
+        """Смещения по seed-хешу из metadata.json (hash_bytes первых байт)."""
+        seed_id = seed_id.rsplit(":", 1)[-1]      # "field:hash" в режиме корпуса
+        if self._by_seed is None:
+            self._by_seed = {hash_bytes(p): p for p in self.patterns}
+        p = self._by_seed.get(seed_id)
+        return self.lookup(p) if p is not None else np.empty(0, dtype=np.uint64)
+
+    def recurring(self):
+        """(pattern, offsets) по убыванию числа вхождений."""
+        return sorted(self.patterns.items(), key=lambda kv: -len(kv[1]))
+
+    def save(self, out_path: Path):
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "window": self.window,
+            "recurring": [
+                {
+                    "pattern": p.hex(),
+                    "seed":    hash_bytes(p),
+                    "count":   len(offs),
+                    "offsets": offs.tolist(),
+                }
+                for p, offs in self.recurring()
+            ],
+        }
+        out_path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "SeedIndex":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        patterns = {
+            bytes.fromhex(r["pattern"]): np.asarray(r["offsets"], dtype=np.uint64)
+            for r in data.get("recurring", [])
+        }
+        return cls(data["window"], patterns)
+
+
+def build_seed_index(
+    raw_file: str,
+    window: int = SEED_SIZE,
+    min_count: int = 2,
+    shards: int = 0,
+    chunk_size: int = CHUNK_SIZE,
+    shard_windows: int = SHARD_WINDOWS,
+    tmp_dir: str = None,
+    logger=None,
+) -> SeedIndex:
+    """
+    1) Один проход по файлу: (h1, h2, смещение) каждого окна
+       раскладываются по шардам (по h1) во временные файлы на диске.
+    2) Шарды обрабатываются по одному, без повторного чтения поля:
+       сортировка по h1 отбрасывает окна, встреченные реже min_count,
+       второй хеш h2 отсекает коллизии первого.
+    shards=0 — по размеру поля, так чтобы в шарде было не больше
+    shard_windows окон; явное значение меньше этого не принимается.
+    Память: один кусок файла или один шард, независимо от размера поля.
+    """
+    raw = Path(raw_file)
+    if raw.stat().st_size < window:
+        return SeedIndex(window, {})
+
+    mm       = np.memmap(raw, dtype=np.uint8, mode="r")
+    n_win    = len(mm) - window + 1
+    nshards  = max(shards, -(-n_win // shard_windows), 1)
+    off_type = np.uint32 if len(mm) <= np.iinfo(np.uint32).max else np.uint64
+    rec_type = np.dtype([("h1", np.uint64), ("h2", np.uint64), ("off", off_type)])
+    patterns, survived = {}, 0
+
+    with tempfile.TemporaryDirectory(prefix="seed_index_", dir=tmp_dir) as tmp:
+        parts = [Path(tmp) / f"shard_{i:05d}.bin" for i in range(nshards)]
+
+        # 1) окна → записи файлов шардов (внутри шарда по возрастанию смещения)
+        for start, chunk in _chunks(mm, window, chunk_size):
+            h1    = window_hashes(chunk, window, BASE1)
+            sid   = _shard_ids(h1, nshards)
+            order = np.argsort(sid, kind="stable")
+            bnd   = np.searchsorted(sid[order], np.arange(nshards + 1))
+            rec   = np.empty(len(order), dtype=rec_type)
+            rec["h1"]  = h1[order]
+            rec["h2"]  = window_hashes(chunk, window, BASE2)[order]
+            rec["off"] = order + start
+            for i in np.flatnonzero(np.diff(bnd)):
+                with open(parts[i], "ab") as f:
+                    rec[bnd[i]: bnd[i + 1]].tofile(f)
+            del h1, sid, order, rec
+
+        # 2) шард за шардом
+        for part in parts:
+            if not part.exists():
+                continue
+            rec = np.fromfile(part, dtype=rec_type)
+            part.unlink()
+
+            # сортируется только h1, записи собираются лишь для выживших
+            order  = np.argsort(rec["h1"])
+            counts = _run_lengths(rec["h1"][order])
+            rec    = rec[order[np.repeat(counts >= min_count, counts)]]
+            del order
+            survived += len(rec)
+            if not len(rec):
+                continue
+
+            # второй хеш отсекает коллизии первого
+            h1, h2, offs = rec["h1"], rec["h2"], rec["off"].astype(np.uint64)
+            order = np.lexsort((offs, h2, h1))
+            h1, h2, offs = h1[order], h2[order], offs[order]
+            counts = _run_lengths(h1, h2)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            for s, c in zip(starts[counts >= min_count], counts[counts >= min_count]):
+                o = int(offs[s])
+                patterns[bytes(mm[o: o + window])] = offs[s: s + c]
+
+    if logger:
+        logger.info("Seed index: окон %d, шардов %d, кандидатов после фильтра %d",
+                    n_win, nshards, survived)
+    return SeedIndex(window, patterns)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(__doc__)
+    p.add_argument("raw_file", help="Path to field.raw")
+    p.add_argument("-o", "--output", default="pipeline_output/seed_index.json")
+    p.add_argument("-w", "--window", type=int, default=SEED_SIZE)
+    p.add_argument("-m", "--min-count", type=int, default=2)
+    p.add_argument("-s", "--shards", type=int, default=0, help="0 = по размеру поля")
+    p.add_argument("--tmp-dir", default=None, help="Каталог для файлов шардов")
+    args = p.parse_args()
+
+    if not Path(args.raw_file).exists():
+        sys.exit(f"[ERROR] Raw file not found: {args.raw_file}")
+    idx = build_seed_index(args.raw_file, args.window, args.min_count, args.shards,
+                           tmp_dir=args.tmp_dir)
+    idx.save(Path(args.output))
+    print(f"[+] Recurring windows: {len(idx)} → {args.output}")
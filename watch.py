@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+watch.py
+
+Сервисный режим: опрашивает каталог новых raw-полей и каталог фрагментов,
+обрабатывает новые/изменённые файлы в пуле процессов (asyncio-воркеры)
+и инкрементально обновляет состояние:
+  - метрики — заменяются/добавляются только строки затронутых фрагментов;
+  - граф — новые fragment-/seed-узлы и рёбра без пересборки;
+  - кластеры — новые фрагменты получают метку ближайшего кластера.
+metrics.pkl, batch.json, clusters.csv, GraphML и graph_stats.json
+публикуются не чаще, чем раз в publish_debounce секунд.
+Нарезанные raw-поля запоминаются в <output_dir>/watch_raw.json, так что
+поля, пришедшие пока сервис не работал, обрабатываются при запуске.
+"""
+
+import time, json, uuid, asyncio, argparse
+import multiprocessing as mp
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import networkx as nx
+
+from metrics_collector import (
+    MetricsAccumulator,
+    collect_metrics,
+    concat_metrics,
+    meta_columns,
+    shannon_entropy
+)
+from cluster_resonance import assign_clusters
+from graph_export import (
+    add_fragments,
+    build_graph,
+    export_graphml,
+    fragment_meta_from_path
+)
+from graph_analysis import analyze_graph
+from metadata_store import open_metadata
+
+RAW_SUFFIXES  = (".raw",)
+FRAG_SUFFIXES = (".bin",)
+PRIMARY_ROOT, SECONDARY_ROOT = "__primary_root__", "__secondary_root__"
+CLUSTER_COLS  = ["path", "size", "strings", "cluster_label", "umap_x", "umap_y"]
+
+
+def scan(directory: Path, suffixes: tuple) -> dict:
+    """{path: (mtime_ns, size)} всех файлов с нужными суффиксами."""
+    out = {}
+    if not directory.exists():
+        return out
+    for p in directory.rglob("*"):
+        if p.suffix.lower() not in suffixes:
+            continue
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            continue
+        out[p] = (st.st_mtime_ns, st.st_size)
+    return out
+
+
+class Poller:
+    """
+    Отдаёт новые и изменённые файлы. Файл считается готовым, когда его
+    (mtime, size) не изменились между двумя опросами — т.е. он дописан.
+    Обработанным (seen) файл становится только после done(path, ok=True);
+    после ошибки он снова будет отдан на следующих опросах.
+    """
+
+    def __init__(self, directory: Path, suffixes: tuple, known: dict = None):
+        self.directory = Path(directory)
+        self.suffixes  = suffixes
+        self.seen      = dict(known or {})
+        self.pending   = {}
+        self.inflight  = {}
+
+    def poll(self) -> list:
+        ready = []
+        for p, sig in scan(self.directory, self.suffixes).items():
+            if self.seen.get(p) == sig or self.inflight.get(p) == sig:
+                continue
+            if self.pending.get(p) == sig:
+                ready.append(p)
+                self.inflight[p] = sig
+                del self.pending[p]
+            else:
+                self.pending[p] = sig
+        return ready
+
+    def done(self, path: Path, ok: bool):
+        """Результат задачи по файлу; возвращает его сигнатуру."""
+        sig = self.inflight.pop(path, None)
+        if ok and sig is not None:
+            self.seen[path] = sig
+        return sig
+
+
+# --- задачи для пула процессов (должны быть top-level) ---
+
+def _extract_job(raw_path: str, frags_dir: str, export_json: bool) -> str:
+    from resonant_extract import extract_fragments
+    ns = Path(raw_path).stem.replace(":", "_")
+    extract_fragments(raw_path, export_json=export_json,
+                      extract_dir=Path(frags_dir), namespace=ns)
+    return ns
+
+
+def _fragment_job(path: str):
+    from batch_analysis import analyze_file
+    data = Path(path).read_bytes()
+    return path, len(data), shannon_entropy(data), analyze_file(path)
+
+
+class WatchState:
+    """Метрики, batch-результаты, кластеры и граф между публикациями."""
+
+    def __init__(self, cfg: dict, logger):
+        self.cfg       = cfg
+        self.logger    = logger
+        self.frags_dir = Path(cfg["fragments_dir"])
+        self.meta_db   = self.frags_dir / "metadata.db"
+        self.out_dir   = Path(cfg["output_dir"])
+        self.metrics_path = self.out_dir / "metrics.pkl"
+        self.batch_path   = self.out_dir / cfg["batch_results"]
+        self.cluster_path = self.out_dir / cfg["cluster_csv"]
+        self.graphml_path = self.out_dir / cfg["graphml"]
+        self.raw_manifest = self.out_dir / "watch_raw.json"
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+        meta_file = next(
+            (m for m in (self.meta_db, Path(cfg["metadata_file"]),
+                         self.frags_dir / "metadata.json") if m.exists()),
+            self.meta_db
+        )
+
+        if self.metrics_path.exists():
+            self.df = pd.read_pickle(self.metrics_path)
+        else:
+            self.df = collect_metrics(str(self.frags_dir), str(meta_file))
+
+        self.batch = {}
+        if self.batch_path.exists():
+            for r in json.loads(self.batch_path.read_text(encoding="utf-8")):
+                self.batch[r["path"]] = r
+
+        if self.cluster_path.exists():
+            self.clusters = pd.read_csv(self.cluster_path)
+        else:
+            self.clusters = pd.DataFrame(columns=CLUSTER_COLS)
+
+        if self.graphml_path.exists():
+            self.G = nx.read_graphml(self.graphml_path)
+        else:
+            self.G = build_graph(
+                meta_file, self.batch_path, self.frags_dir,
+                cfg["node_attrs"], cfg["edge_attrs"], cfg["color_by"],
+                False, 0, False, False, logger
+            )
+
+        self.pending     = {}       # path → (size, entropy, batch-запись)
+        self.first_dirty = None
+        self.last_dirty  = None
+        logger.info("Watch: состояние загружено — метрик %d, узлов %d",
+                    len(self.df), self.G.number_of_nodes())
+
+    def known_fragments(self) -> dict:
+        """Сигнатуры фрагментов, уже учтённых в метриках."""
+        known = set(self.df["path"]) if len(self.df) else set()
+        return {p: sig for p, sig in scan(self.frags_dir, FRAG_SUFFIXES).items()
+                if str(p) in known}
+
+    def known_raw(self) -> dict:
+        """Сигнатуры raw-полей, уже нарезанных (манифест в output_dir)."""
+        if not self.raw_manifest.exists():
+            return {}
+        data = json.loads(self.raw_manifest.read_text(encoding="utf-8"))
+        return {Path(p): tuple(sig) for p, sig in data.items()}
+
+    def mark_raw(self, path: Path, sig: tuple):
+        data = {str(p): list(s) for p, s in self.known_raw().items()}
+        data[str(path)] = list(sig)
+        tmp = self.raw_manifest.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(self.raw_manifest)
+
+    def apply(self, path: str, size: int, ent: float, batch_rec: dict):
+        self.pending[path] = (size, ent, batch_rec)
+        now = time.monotonic()
+        self.first_dirty = self.first_dirty or now
+        self.last_dirty  = now
+
+    def ready(self, debounce: float) -> bool:
+        # ждём паузы в потоке файлов, но не дольше 10 интервалов подряд
+        if not self.pending:
+            return False
+        now = time.monotonic()
+        return (now - self.last_dirty >= debounce
+                or now - self.first_dirty >= 10 * debounce)
+
+    def flush(self):
+        """Вливает накопленные фрагменты в состояние; возвращает снимок для публикации."""
+        items, self.pending = self.pending, {}
+        self.first_dirty = self.last_dirty = None
+
+        store = open_metadata(self.meta_db)
+        metas = {}
+        for p in items:
+            name = Path(p).name
+            metas[name] = store.get(name) or fragment_meta_from_path(Path(p))
+        store.close()
+
+        # метрики: только затронутые строки
+        acc = MetricsAccumulator()
+        for p, (size, ent, _) in items.items():
+            acc.append(p, Path(p).parent.name, size, ent,
+                       **meta_columns(metas[Path(p).name]))
+        new = acc.to_frame()
+        old = self.df[~self.df["path"].isin(new["path"])] if len(self.df) else self.df
+        self.df = concat_metrics([old, new])
+
+        # batch + кластеры по ближайшему центроиду
+        for p, (_, _, rec) in items.items():
+            self.batch[p] = rec
+        feats = pd.DataFrame({
+            "path":    list(items),
+            "size":    [v[0] for v in items.values()],
+            "strings": [len(str(v[2].get("strings", "")).splitlines()) for v in items.values()],
+        })
+        feats["cluster_label"] = assign_clusters(self.clusters, feats)
+        old = self.clusters[~self.clusters["path"].isin(feats["path"])]
+        self.clusters = pd.concat([old, feats], ignore_index=True)[CLUSTER_COLS]
+
+        # граф: новые узлы/рёбра + те же корни и placeholders, что в build_graph
+        G = self.G
+        new_nodes = [n for n in metas if n not in G]
+        seeds, cnt = add_fragments(G, metas, self.cfg["node_attrs"], self.cfg["edge_attrs"])
+        if PRIMARY_ROOT in G:
+            for sd in seeds:
+                G.add_edge(PRIMARY_ROOT, sd, edge_type="root_link")
+        for n in list(new_nodes):
+            if G.in_degree(n) == 0:
+                ph = f"ph_{uuid.uuid4().hex[:6]}"
+                G.add_edge(ph, n, edge_type="placeholder")
+                new_nodes.append(ph)
+        if SECONDARY_ROOT in G:
+            for n in new_nodes:
+                G.add_edge(SECONDARY_ROOT, n, edge_type="root_link")
+
+        self.logger.info("Watch: +%d фрагментов, seed→fragment рёбер %d, метрик %d",
+                         len(items), cnt, len(self.df))
+        return self.df, list(self.batch.values()), self.clusters, G.copy()
+
+    def publish(self, snapshot):
+        df, batch, clusters, G = snapshot
+        df.to_pickle(self.metrics_path)
+        self.batch_path.write_text(json.dumps(batch, indent=2), encoding="utf-8")
+        clusters.to_csv(self.cluster_path, index=False)
+        export_graphml(G, str(self.graphml_path))
+        # betweenness на каждой публикации — по выборке источников
+        stats = analyze_graph(G, self.out_dir,
+                              betweenness_k=int(self.cfg.get("watch_betweenness_k", 64)))
+        self.logger.info("Watch: опубликовано — Nodes=%d Edges=%d",
+                         stats["num_nodes"], stats["num_edges"])
+
+
+async def run_watch(cfg: dict, logger, jobs: int = None):
+    """Бесконечный цикл опроса; останавливается по Ctrl+C / отмене задачи."""
+    interval = float(cfg.get("watch_interval", 2.0))
+    debounce = float(cfg.get("publish_debounce", 5.0))
+    raw_dir  = Path(cfg.get("watch_raw_dir", "incoming"))
+    jobs     = jobs or int(cfg["jobs"])
+
+    state = WatchState(cfg, logger)
+    export   = bool(cfg.get("metadata_json_export", True))
+    # уже нарезанные поля — из манифеста: файлы, пришедшие пока сервис
+    # не работал или загружался, будут обработаны
+    raw_poller  = Poller(raw_dir, RAW_SUFFIXES, known=state.known_raw())
+    frag_poller = Poller(state.frags_dir, FRAG_SUFFIXES, known=state.known_fragments())
+    queue = asyncio.Queue()
+    loop  = asyncio.get_running_loop()
+    extracting = 0
+
+    async def worker(pool):
+        nonlocal extracting
+        while True:
+            kind, path = await queue.get()
+            poller = raw_poller if kind == "raw" else frag_poller
+            try:
+                if kind == "raw":
+                    ns = await loop.run_in_executor(pool, _extract_job, str(path),
+                                                    str(state.frags_dir), export)
+                    state.mark_raw(path, poller.done(path, True))
+                    logger.info("Watch: поле %s нарезано", ns)
+                else:
+                    state.apply(*await loop.run_in_executor(pool, _fragment_job, str(path)))
+                    poller.done(path, True)
+            except Exception as e:
+                poller.done(path, False)
+                logger.error("Watch: ошибка обработки %s (повтор при следующем опросе): %s", path, e)
+            finally:
+                if kind == "raw":
+                    extracting -= 1
+                queue.task_done()
+
+    async def poller():
+        nonlocal extracting
+        while True:
+            for p in raw_poller.poll():
+                extracting += 1
+                queue.put_nowait(("raw", p))
+            # пока поле режется, его фрагменты ещё без метаданных — ждём
+            if not extracting:
+                for p in frag_poller.poll():
+                    queue.put_nowait(("fragment", p))
+            await asyncio.sleep(interval)
+
+    async def publisher():
+        while True:
+            await asyncio.sleep(min(interval, debounce))
+            if not state.ready(debounce):
+                continue
+            try:
+                await asyncio.to_thread(state.publish, state.flush())
+            except Exception as e:
+                logger.error("Watch: ошибка публикации: %s", e)
+
+    logger.info("Watch: raw=%s fragments=%s, воркеров %d, debounce %.1fs",
+                raw_dir, state.frags_dir, jobs, debounce)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp.get_context("spawn")) as pool:
+        tasks = [asyncio.create_task(worker(pool)) for _ in range(jobs)]
+        tasks += [asyncio.create_task(poller()), asyncio.create_task(publisher())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            if state.pending:
+                state.publish(state.flush())
+
+
+if __name__ == "__main__":
+    from pipeline import setup_logging, load_config
+
+    logger = setup_logging()
+    p = argparse.ArgumentParser(__doc__)
+    p.add_argument("--config", "-c", default="config.yaml")
+    args = p.parse_args()
+    try:
+        asyncio.run(run_watch(load_config(args.config, logger), logger))
+    except KeyboardInterrupt:
+        logger.info("Watch: остановлен")